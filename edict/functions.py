@@ -9,11 +9,15 @@ Classes are ProgramElement objects.
 Functions create an implicit ProgramElement if necessary.
 """
 
+import ast
+import datetime
+import functools
 import sys
 from decimal import Decimal
 from typing import Callable, Dict, Optional, Sequence, Type
 
 from .program_base import (
+    CodeGenerator,
     DataType,
     EPrepareError,
     ProgramElement,
@@ -41,6 +45,8 @@ __all__ = [
 
 
 class FunctionCall(ProgramElement[T]):
+    __slots__ = ()
+
     name: str
 
 
@@ -51,11 +57,20 @@ class _ImplicitFunctionCall(FunctionCall[T]):
     Implicit functions may only take a single argument.
     """
 
+    __slots__ = ("inner", "implicit")
+
     def __init__(self, inner: ProgramElement, dtype: DataType, implicit: bool = False):
         super().__init__(dtype=dtype)
         self.inner = inner
         self.implicit = implicit
 
+    def is_constant(self) -> bool:
+        return self.inner.is_constant()
+
+    def fold(self) -> ProgramElement[T]:
+        self.inner = self.inner.fold()
+        return self._fold_constant()
+
     def __str__(self):
         if self.implicit:
             return str(self.inner)
@@ -80,9 +95,17 @@ def as_boolean(inner: ProgramElement) -> ProgramElement[bool]:
     raise EPrepareError(f"Cannot interpret {inner.dtype} as BOOLEAN")
 
 
+@functools.lru_cache(maxsize=8192)
+def _parse_number(value: str, separator: str) -> Decimal:
+    """Parse a number, sharing the result for repeated values."""
+    return Decimal(value.replace(separator, ""))
+
+
 class AsNumber(_ImplicitFunctionCall[Decimal]):
     """Interpret a value as a number."""
 
+    __slots__ = ("separator",)
+
     name = "as_number"
 
     def __init__(
@@ -104,7 +127,23 @@ class AsNumber(_ImplicitFunctionCall[Decimal]):
         assert isinstance(
             value, str
         ), f"{self.__class__.__name__}: Invalid input {value!r}"
-        return Decimal(value.replace(self.separator, ""))
+        return _parse_number(value, self.separator)
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        inner = self.inner.to_ast(generator)
+        # The type check in _call is resolved statically
+        if self.inner.dtype == DataType.NUMBER:
+            return inner
+
+        def parse(value: ast.expr) -> ast.expr:
+            return ast.Call(
+                func=generator.constant(_parse_number),
+                args=[value, ast.Constant(value=self.separator)],
+                keywords=[],
+            )
+
+        # Fields are often compared as numbers more than once
+        return generator.derived(inner, ("number", self.separator), parse)
 
 
 def as_number(inner: ProgramElement) -> ProgramElement[Decimal]:
@@ -116,6 +155,8 @@ def as_number(inner: ProgramElement) -> ProgramElement[Decimal]:
 class AsString(_ImplicitFunctionCall[str]):
     """Interpret a value a string."""
 
+    __slots__ = ()
+
     name = "as_string"
 
     def __init__(self, inner: ProgramElement, *, implicit: bool = False):
@@ -126,6 +167,12 @@ class AsString(_ImplicitFunctionCall[str]):
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return self.inner(record, context)
 
+    def is_pure(self) -> bool:
+        return self.inner.is_pure()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return self.inner.to_ast(generator)
+
 
 def as_string(inner: ProgramElement) -> ProgramElement[str]:
     if inner.dtype == DataType.STRING:
@@ -145,6 +192,8 @@ def as_type(inner: ProgramElement, dtype: DataType) -> ProgramElement:
 class CaseFold(_ImplicitFunctionCall[str]):
     """Casefold a string for case insensitive comparison."""
 
+    __slots__ = ()
+
     name = "casefold"
 
     def __init__(self, inner: ProgramElement[str], implicit: bool = False):
@@ -153,6 +202,17 @@ class CaseFold(_ImplicitFunctionCall[str]):
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return self.inner(record, context).casefold()
 
+    def is_pure(self) -> bool:
+        return self.inner.is_pure()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        # Fields are often compared case insensitively more than once
+        return generator.derived(
+            self.inner.to_ast(generator),
+            "casefold",
+            lambda value: generator.method_call(value, "casefold"),
+        )
+
 
 def casefold(inner: ProgramElement[str]) -> ProgramElement[str]:
     return CaseFold(inner, implicit=True)
@@ -161,6 +221,8 @@ def casefold(inner: ProgramElement[str]) -> ProgramElement[str]:
 class InputProtocol(FunctionCall[str]):
     """Name of the input protocol in the current runtime context."""
 
+    __slots__ = ()
+
     name = "input_protocol"
 
     def __init__(self):
@@ -169,10 +231,17 @@ class InputProtocol(FunctionCall[str]):
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return context.input_protocol
 
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.Attribute(
+            value=generator.context(), attr="input_protocol", ctx=ast.Load()
+        )
+
 
 class Log(FunctionCall[None]):
     """Log all arguments to standard error."""
 
+    __slots__ = ("args",)
+
     name = "log"
 
     def __init__(self, *args: ProgramElement):
@@ -182,10 +251,27 @@ class Log(FunctionCall[None]):
         values = [arg(record, context) for arg in self.args]
         print(*values, file=sys.stderr)
 
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        # sys.stderr is looked up on each call in case it is replaced
+        stderr = ast.Attribute(
+            value=generator.constant(sys), attr="stderr", ctx=ast.Load()
+        )
+        return ast.Call(
+            func=generator.constant(print),
+            args=[arg.to_ast(generator) for arg in self.args],
+            keywords=[ast.keyword(arg="file", value=stderr)],
+        )
+
+    def fold(self) -> ProgramElement[None]:
+        self.args = [arg.fold() for arg in self.args]
+        return self
+
 
 class OutputProtocol(FunctionCall[str]):
     """Name of the output protocol in the current runtime context."""
 
+    __slots__ = ()
+
     name = "output_protocol"
 
     def __init__(self):
@@ -194,10 +280,17 @@ class OutputProtocol(FunctionCall[str]):
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return context.output_protocol
 
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.Attribute(
+            value=generator.context(), attr="output_protocol", ctx=ast.Load()
+        )
+
 
 class ReadDate(FunctionCall[str]):
     """Read a date and format as an ISO 8601 string."""
 
+    __slots__ = ("date_string", "date_format")
+
     name = "read_date"
 
     def __init__(
@@ -208,8 +301,6 @@ class ReadDate(FunctionCall[str]):
         self.date_format = as_string(date_format)
 
     def _call(self, record: Record, context: RuntimeContext) -> str:
-        import datetime
-
         return (
             datetime.datetime.strptime(
                 self.date_string(record, context),
@@ -219,6 +310,26 @@ class ReadDate(FunctionCall[str]):
             .isoformat()
         )
 
+    def is_constant(self) -> bool:
+        return self.date_string.is_constant() and self.date_format.is_constant()
+
+    def fold(self) -> ProgramElement[str]:
+        self.date_string = self.date_string.fold()
+        self.date_format = self.date_format.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        # A literal format is generated as a constant so it is evaluated once
+        parsed = ast.Call(
+            func=generator.constant(datetime.datetime.strptime),
+            args=[
+                self.date_string.to_ast(generator),
+                self.date_format.to_ast(generator),
+            ],
+            keywords=[],
+        )
+        return generator.method_call(generator.method_call(parsed, "date"), "isoformat")
+
 
 class RecordStr(FunctionCall[str]):
     """Format the current record as a string.
@@ -226,6 +337,8 @@ class RecordStr(FunctionCall[str]):
     This is meant to be a pretty-printer, not an unambiguous serialization.
     """
 
+    __slots__ = ("field_separator",)
+
     name = "record_str"
 
     def __init__(self, field_separator: str = "\n"):
@@ -254,6 +367,16 @@ def _decimal_as_int(x: Decimal) -> int:
     return numerator
 
 
+def _decimal_as_int_ast(
+    value: ProgramElement[Decimal], generator: CodeGenerator
+) -> ast.expr:
+    return ast.Call(
+        func=generator.constant(_decimal_as_int),
+        args=[value.to_ast(generator)],
+        keywords=[],
+    )
+
+
 class Replace(FunctionCall[str]):
     """Replace substrings in a string
 
@@ -264,6 +387,8 @@ class Replace(FunctionCall[str]):
         count: Maximum number of occurrences to replace
     """
 
+    __slots__ = ("inner", "old", "new", "count")
+
     name = "replace"
 
     def __init__(
@@ -289,6 +414,35 @@ class Replace(FunctionCall[str]):
             count_value = -1
         return inner_value.replace(old_value, new_value, count_value)
 
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        if self.count is not None:
+            count = _decimal_as_int_ast(self.count, generator)
+        else:
+            count = ast.Constant(value=-1)
+        return generator.method_call(
+            self.inner.to_ast(generator),
+            "replace",
+            self.old.to_ast(generator),
+            self.new.to_ast(generator),
+            count,
+        )
+
+    def is_constant(self) -> bool:
+        return (
+            self.inner.is_constant()
+            and self.old.is_constant()
+            and self.new.is_constant()
+            and (self.count is None or self.count.is_constant())
+        )
+
+    def fold(self) -> ProgramElement[str]:
+        self.inner = self.inner.fold()
+        self.old = self.old.fold()
+        self.new = self.new.fold()
+        if self.count is not None:
+            self.count = self.count.fold()
+        return self._fold_constant()
+
 
 class Round(FunctionCall[Decimal]):
     """Round number to a given number of decimal places
@@ -299,6 +453,8 @@ class Round(FunctionCall[Decimal]):
                  Defaults to 0.
     """
 
+    __slots__ = ("inner", "ndigits")
+
     name = "round"
 
     def __init__(
@@ -318,6 +474,28 @@ class Round(FunctionCall[Decimal]):
             ndigits_value = 0
         return round(inner_value, ndigits_value)
 
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        if self.ndigits is not None:
+            ndigits = _decimal_as_int_ast(self.ndigits, generator)
+        else:
+            ndigits = ast.Constant(value=0)
+        return ast.Call(
+            func=generator.constant(round),
+            args=[self.inner.to_ast(generator), ndigits],
+            keywords=[],
+        )
+
+    def is_constant(self) -> bool:
+        return self.inner.is_constant() and (
+            self.ndigits is None or self.ndigits.is_constant()
+        )
+
+    def fold(self) -> ProgramElement[Decimal]:
+        self.inner = self.inner.fold()
+        if self.ndigits is not None:
+            self.ndigits = self.ndigits.fold()
+        return self._fold_constant()
+
 
 class SubString(FunctionCall[str]):
     """Extract a substring.
@@ -329,6 +507,8 @@ class SubString(FunctionCall[str]):
         end: Index of one past the end of the substring.
     """
 
+    __slots__ = ("inner", "start", "end")
+
     name = "substring"
 
     def __init__(
@@ -351,6 +531,34 @@ class SubString(FunctionCall[str]):
             end_value = None
         return inner_value[start_value:end_value]
 
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        end = (
+            _decimal_as_int_ast(self.end, generator)
+            if self.end is not None
+            else ast.Constant(value=None)
+        )
+        return ast.Subscript(
+            value=self.inner.to_ast(generator),
+            slice=ast.Slice(
+                lower=_decimal_as_int_ast(self.start, generator), upper=end
+            ),
+            ctx=ast.Load(),
+        )
+
+    def is_constant(self) -> bool:
+        return (
+            self.inner.is_constant()
+            and self.start.is_constant()
+            and (self.end is None or self.end.is_constant())
+        )
+
+    def fold(self) -> ProgramElement[str]:
+        self.inner = self.inner.fold()
+        self.start = self.start.fold()
+        if self.end is not None:
+            self.end = self.end.fold()
+        return self._fold_constant()
+
 
 # Public API functions
 _PUBLIC_FUNCTIONS: Sequence[Type[FunctionCall]] = (
@@ -56,7 +56,7 @@ class Edict:
         fields = program.fields(data.fields)
         return RecordStream(
             fields=fields,
-            records=(program.transform(record, context) for record in data.records),
+            records=program.transform_many(data.records, context, in_place=True),
         )
 
 
@@ -136,6 +136,9 @@ class ScriptContext:
     Attributes:
         file_path: Script file path
         case_insensitive: Whether match operations are case insensitive
+        reorder_conditions: Whether to reorder conditions based on a profile
+        num_profiled_records: Number of records to profile before reordering
+        match_cache_size: Number of regex match results to cache per pattern
         default_field: Default field to use with implicit matching
         output_fields: Restrict the output dictionary to have these fields
         pre_transform: Transformation to apply to the record stream before per-record
@@ -144,6 +147,9 @@ class ScriptContext:
 
     file_path: Optional[Path] = None
     case_insensitive: bool = False
+    reorder_conditions: bool = False
+    num_profiled_records: int = 1000
+    match_cache_size: int = 0
     default_field: Optional[program.Identifier] = None
     output_fields: Optional[List[str]] = None
     pre_transform: Optional[StreamEditor] = None
@@ -153,6 +159,24 @@ def _directive_case_insensitive(context: ScriptContext):
     context.case_insensitive = True
 
 
+def _positive_integer(number) -> int:
+    if number.dtype != program.DataType.NUMBER:
+        raise ValueError(f"Expected NUMBER but got {number.dtype}")
+    if number.value < 1 or number.value != number.value.to_integral_value():
+        raise ValueError(f"Expected a positive integer but got {number.value}")
+    return int(number.value)
+
+
+def _directive_reorder_conditions(context: ScriptContext, num_records=None):
+    context.reorder_conditions = True
+    if num_records is not None:
+        context.num_profiled_records = _positive_integer(num_records)
+
+
+def _directive_match_cache_size(context: ScriptContext, size):
+    context.match_cache_size = _positive_integer(size)
+
+
 def _directive_default_field(context: ScriptContext, identifier):
     if identifier.dtype != program.DataType.STRING:
         raise ValueError(f"Expected STRING but got {identifier.dtype}")
@@ -175,7 +199,9 @@ def _directive_pre_transform(context: ScriptContext, name, *args):
 HEADER_DIRECTIVES = {
     "case_insensitive": _directive_case_insensitive,
     "default_field": _directive_default_field,
+    "match_cache_size": _directive_match_cache_size,
     "output_fields": _directive_output_fields,
+    "reorder_conditions": _directive_reorder_conditions,
     "reverse": functools.partial(_directive_pre_transform, name="reverse"),
 }
 
@@ -401,7 +427,12 @@ class _TransformToProgram(lark.Transformer):
         if header.output_fields is not None:
             statements.append(program.Fields(header.output_fields))
         return (
-            program.Program(statements=statements),
+            program.Program(
+                statements=statements,
+                reorder_conditions=self._context.reorder_conditions,
+                num_profiled_records=self._context.num_profiled_records,
+                match_cache_size=self._context.match_cache_size,
+            ),
             self._context.pre_transform,
         )
 
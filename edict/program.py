@@ -2,21 +2,32 @@
 
 from __future__ import annotations
 
+import ast
+import functools
+import operator
 import re
+import sys
+import time
 from decimal import Decimal
 from typing import (
     Any,
     Callable,
+    Dict,
     Generic,
     Iterable,
+    Iterator,
     List,
     Optional,
     Sequence,
     Tuple,
+    Type,
     TypeVar,
 )
 
 from .functions import (
+    AsNumber,
+    AsString,
+    CaseFold,
     as_boolean,
     as_number,
     as_string,
@@ -24,9 +35,17 @@ from .functions import (
     casefold,
     function_call,
 )
-from .program_base import DataType, ProgramElement, RuntimeContext, T, string_encode
+from .program_base import (
+    CodeGenerator,
+    DataType,
+    ERuntimeError,
+    Evaluator,
+    ProgramElement,
+    RuntimeContext,
+    T,
+    string_encode,
+)
 from .types import Record
-from .utils import OrderedSet
 
 __all__ = [
     "Assignment",
@@ -54,17 +73,34 @@ __all__ = [
 
 T_literal = TypeVar("T_literal", str, bool, Decimal)
 
+# String literals shorter than this are interned.
+# Short literals are likely to be compared against or stored as record values.
+_MAX_INTERN_LITERAL_LENGTH = 64
+
 
 class Literal(ProgramElement[T_literal]):
     """Stores a constant value."""
 
+    __slots__ = ("value",)
+
     def __init__(self, value: T_literal, dtype: DataType):
         super().__init__(dtype=dtype)
+        if isinstance(value, str) and len(value) < _MAX_INTERN_LITERAL_LENGTH:
+            value = sys.intern(value)  # type: ignore
         self.value: T_literal = value
 
     def _call(self, record: Record, context: RuntimeContext) -> T_literal:
         return self.value
 
+    def is_constant(self) -> bool:
+        return True
+
+    def is_pure(self) -> bool:
+        return True
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return generator.constant(self.value)
+
     def __str__(self):
         if isinstance(self.value, str):
             return repr(self.value)
@@ -75,18 +111,29 @@ class Literal(ProgramElement[T_literal]):
 class Identifier(ProgramElement[str]):
     """Stores a record field name."""
 
+    __slots__ = ("name",)
+
     def __init__(self, name: str):
         super().__init__(dtype=DataType.INDETERMINANT_STRING)
-        self.name = name
+        # Interned keys let dict lookups succeed on an identity check
+        self.name = sys.intern(name)
 
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return record.get(self.name, "")
 
+    def is_pure(self) -> bool:
+        return True
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return generator.field(self.name)
+
     def __str__(self):
         return f"{{{self.name}}}"
 
 
 class UnaryMinus(ProgramElement[Decimal]):
+    __slots__ = ("inner",)
+
     def __init__(self, inner: ProgramElement):
         super().__init__(dtype=DataType.NUMBER)
         self.inner = as_number(inner)
@@ -94,6 +141,16 @@ class UnaryMinus(ProgramElement[Decimal]):
     def _call(self, record: Record, context: RuntimeContext) -> Decimal:
         return -self.inner(record, context)
 
+    def is_constant(self) -> bool:
+        return self.inner.is_constant()
+
+    def fold(self) -> ProgramElement[Decimal]:
+        self.inner = self.inner.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.UnaryOp(op=ast.USub(), operand=self.inner.to_ast(generator))
+
     def __str__(self):
         return f"-({self.inner})"
 
@@ -103,6 +160,8 @@ T2 = TypeVar("T2", str, bool, Decimal, None)
 
 
 class BinaryOperator(ProgramElement[T], Generic[T, T1, T2]):
+    __slots__ = ("left", "right", "op")
+
     def __init__(
         self,
         left: ProgramElement,
@@ -126,13 +185,56 @@ class BinaryOperator(ProgramElement[T], Generic[T, T1, T2]):
         right_value = self.right(record, context)
         return self.op(left_value, right_value)
 
+    def is_constant(self) -> bool:
+        return self.left.is_constant() and self.right.is_constant()
+
+    def fold(self) -> ProgramElement[T]:
+        self.left = self.left.fold()
+        self.right = self.right.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        left = self.left.to_ast(generator)
+        right = self.right.to_ast(generator)
+        # Operators are generated as Python operators rather than function calls
+        if self.op in _AST_COMPARE_OPS:
+            return ast.Compare(
+                left=left, ops=[_AST_COMPARE_OPS[self.op]()], comparators=[right]
+            )
+        if self.op in _AST_BINARY_OPS:
+            return ast.BinOp(left=left, op=_AST_BINARY_OPS[self.op](), right=right)
+        return ast.Call(
+            func=generator.constant(self.op), args=[left, right], keywords=[]
+        )
+
     def __str__(self):
         return f"{self.left} .{self.op.__name__}. {self.right}"
 
 
+_AST_COMPARE_OPS: Dict[Callable, Type[ast.cmpop]] = {
+    operator.eq: ast.Eq,
+    operator.ne: ast.NotEq,
+    operator.lt: ast.Lt,
+    operator.le: ast.LtE,
+    operator.gt: ast.Gt,
+    operator.ge: ast.GtE,
+}
+
+# Operands are strings or decimals so concatenation is addition
+_AST_BINARY_OPS: Dict[Callable, Type[ast.operator]] = {
+    operator.add: ast.Add,
+    operator.concat: ast.Add,
+    operator.mul: ast.Mult,
+    operator.sub: ast.Sub,
+    operator.truediv: ast.Div,
+}
+
+
 class ValueComparisonOperator(BinaryOperator[bool, Any, Any]):
     """Compare two values."""
 
+    __slots__ = ()
+
     def __init__(
         self,
         left: ProgramElement,
@@ -160,8 +262,24 @@ class ValueComparisonOperator(BinaryOperator[bool, Any, Any]):
             dtype_right=dtype_in,
         )
 
+    def is_pure(self) -> bool:
+        # Comparing numbers may raise e.g. for NaN
+        return (
+            self.left.dtype == DataType.STRING
+            and self.left.is_pure()
+            and self.right.is_pure()
+        )
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_regex(pattern: str, flags: int) -> re.Pattern:
+    """Compile a regular expression, sharing the result for repeated patterns."""
+    return re.compile(pattern, flags)
+
 
 class Match(ProgramElement[bool]):
+    __slots__ = ("compiled_pattern", "string", "_literal")
+
     def __init__(
         self,
         pattern: Literal[str],
@@ -169,20 +287,99 @@ class Match(ProgramElement[bool]):
         case_insensitive: bool = False,
     ):
         super().__init__(dtype=DataType.BOOLEAN)
-        if pattern.dtype == DataType.REGEX:
-            flags = re.IGNORECASE if case_insensitive else 0
-            self.compiled_pattern = re.compile(pattern.value, flags)
+        if pattern.dtype != DataType.REGEX:
+            raise ValueError(f"Expected REGEX pattern but got {pattern.dtype}")
+        flags = re.IGNORECASE if case_insensitive else 0
+        self.compiled_pattern = _compile_regex(pattern.value, flags)
         self.string = as_string(string)
+        # Literal patterns are matched with string methods instead of the regex
+        # engine. A tuple (literal, is_prefix).
+        self._literal: Optional[Tuple[str, bool]] = None
+        if not case_insensitive:
+            self._literal = _regex_literal(pattern.value)
 
     def _call(self, record: Record, context: RuntimeContext) -> bool:
         string = self.string(record, context)
         return bool(self.compiled_pattern.search(string))
 
+    def is_pure(self) -> bool:
+        return self.string.is_pure()
+
+    def is_constant(self) -> bool:
+        return self.string.is_constant()
+
+    def fold(self) -> ProgramElement[bool]:
+        self.string = self.string.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        string = self.string.to_ast(generator)
+        if self._literal is not None:
+            literal, is_prefix = self._literal
+            if is_prefix:
+                return generator.method_call(
+                    string, "startswith", ast.Constant(value=literal)
+                )
+            return ast.Compare(
+                left=ast.Constant(value=literal), ops=[ast.In()], comparators=[string]
+            )
+        if generator.match_cache_size:
+            cache = _MatchCache(self.compiled_pattern, generator.match_cache_size)
+            return generator.subscript(generator.constant(cache), string)
+        return generator.is_not_none(
+            ast.Call(
+                func=generator.constant(self.compiled_pattern.search),
+                args=[string],
+                keywords=[],
+            )
+        )
+
     def __str__(self):
         return f"{self.string} ~ {self.compiled_pattern}"
 
 
+class _MatchCache(dict):
+    """Whether a pattern matches each string. Indexing searches missing strings.
+
+    Stops caching new strings once full. Caching the first strings seen works
+    well for the low-cardinality fields where caching helps.
+    """
+
+    def __init__(self, pattern: re.Pattern, max_size: int):
+        super().__init__()
+        self._search = pattern.search
+        self._max_size = max_size
+
+    def __missing__(self, string: str) -> bool:
+        value = self._search(string) is not None
+        if len(self) < self._max_size:
+            self[string] = value
+        return value
+
+
+# A regular expression of literal characters, optionally anchored at the start.
+# Only non-alphanumeric characters are escaped to avoid escapes like \d.
+_LITERAL_REGEX = re.compile(r"(\^?)((?:[^.^$*+?{}\[\]\\|()]|\\[^A-Za-z0-9])*)")
+
+
+def _regex_literal(pattern: str) -> Optional[Tuple[str, bool]]:
+    """Match a regular expression consisting of a literal string.
+
+    Returns:
+        None if the pattern is not a literal string.
+        Otherwise, a tuple (literal, is_prefix) where `is_prefix` is True if the
+        pattern only matches at the start of the string.
+    """
+    match = _LITERAL_REGEX.fullmatch(pattern)
+    if match is None:
+        return None
+    anchor, escaped = match.groups()
+    return re.sub(r"\\(.)", r"\1", escaped, flags=re.DOTALL), bool(anchor)
+
+
 class SubString(ProgramElement[bool]):
+    __slots__ = ("substring", "string")
+
     def __init__(
         self,
         substring: Literal[str],
@@ -192,19 +389,40 @@ class SubString(ProgramElement[bool]):
         super().__init__(dtype=DataType.BOOLEAN)
         self.substring = substring.value
         self.string = as_string(string)
+        # Casefolding then searching is much faster than an IGNORECASE regex search
         if case_insensitive:
             self.substring = self.substring.casefold()
             self.string = casefold(self.string)
+        self.substring = sys.intern(self.substring)
 
     def _call(self, record: Record, context: RuntimeContext) -> bool:
         string = self.string(record, context)
         return self.substring in string
 
+    def is_pure(self) -> bool:
+        return self.string.is_pure()
+
+    def is_constant(self) -> bool:
+        return self.string.is_constant()
+
+    def fold(self) -> ProgramElement[bool]:
+        self.string = self.string.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.Compare(
+            left=ast.Constant(value=self.substring),
+            ops=[ast.In()],
+            comparators=[self.string.to_ast(generator)],
+        )
+
     def __str__(self):
         return f"{self.string} ~ {self.substring!r}"
 
 
 class UnaryNot(ProgramElement[bool]):
+    __slots__ = ("inner",)
+
     def __init__(self, inner: ProgramElement):
         super().__init__(dtype=DataType.BOOLEAN)
         self.inner = as_boolean(inner)
@@ -212,54 +430,278 @@ class UnaryNot(ProgramElement[bool]):
     def _call(self, record: Record, context: RuntimeContext) -> bool:
         return not self.inner(record, context)
 
+    def is_pure(self) -> bool:
+        return self.inner.is_pure()
+
+    def is_constant(self) -> bool:
+        return self.inner.is_constant()
+
+    def fold(self) -> ProgramElement[bool]:
+        self.inner = self.inner.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.UnaryOp(op=ast.Not(), operand=self.inner.to_ast(generator))
+
     def __str__(self):
         return "!({self.inner})"
 
 
 class Conjunction(ProgramElement[bool]):
+    __slots__ = ("parts",)
+
     def __init__(self, parts: Sequence[ProgramElement]):
         super().__init__(dtype=DataType.BOOLEAN)
         self.parts = [as_boolean(part) for part in parts]
 
     def _call(self, record: Record, context: RuntimeContext) -> bool:
-        # Short-circuiting evaluation
-        return all(part(record, context) for part in self.parts)
+        # Short-circuiting evaluation without a generator
+        for part in self.parts:
+            if not part(record, context):
+                return False
+        return True
+
+    def is_constant(self) -> bool:
+        return all(part.is_constant() for part in self.parts)
+
+    def is_pure(self) -> bool:
+        return all(part.is_pure() for part in self.parts)
+
+    def fold(self) -> ProgramElement[bool]:
+        self.parts = _order_by_cost(_fold_parts(self.parts, short_circuit=False))
+        if not self.parts:
+            return Literal(True, DataType.BOOLEAN)
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return self
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.BoolOp(op=ast.And(), values=_parts_ast(self.parts, False, generator))
 
     def __str__(self):
         return " & ".join(str(part) for part in self.parts)
 
 
 class Disjunction(ProgramElement[bool]):
+    __slots__ = ("parts",)
+
     def __init__(self, parts: Sequence[ProgramElement]):
         super().__init__(dtype=DataType.BOOLEAN)
         self.parts = [as_boolean(part) for part in parts]
 
     def _call(self, record: Record, context: RuntimeContext) -> bool:
-        # Short-circuiting evaluation
-        return any(part(record, context) for part in self.parts)
+        # Short-circuiting evaluation without a generator
+        for part in self.parts:
+            if part(record, context):
+                return True
+        return False
+
+    def is_constant(self) -> bool:
+        return all(part.is_constant() for part in self.parts)
+
+    def is_pure(self) -> bool:
+        return all(part.is_pure() for part in self.parts)
+
+    def fold(self) -> ProgramElement[bool]:
+        self.parts = _order_by_cost(_fold_parts(self.parts, short_circuit=True))
+        if not self.parts:
+            return Literal(False, DataType.BOOLEAN)
+        if len(self.parts) == 1:
+            return self.parts[0]
+        return self
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.BoolOp(op=ast.Or(), values=_parts_ast(self.parts, True, generator))
 
     def __str__(self):
         return "\n".join(f"| {part}" for part in self.parts)
 
 
+def _fold_parts(
+    parts: Sequence[ProgramElement[bool]], short_circuit: bool
+) -> List[ProgramElement[bool]]:
+    """Fold the parts of a short-circuiting boolean operator.
+
+    Args:
+        parts: The parts of the operator.
+        short_circuit: The part value that determines the result of the operator.
+            False for a conjunction and True for a disjunction.
+
+    Returns:
+        The folded parts with constant parts that cannot determine the result
+        removed and with any parts following a constant `short_circuit` removed.
+    """
+    folded = []
+    for part in parts:
+        part = part.fold()
+        if isinstance(part, Literal):
+            if part.value != short_circuit:
+                continue
+            folded.append(part)
+            break
+        folded.append(part)
+    return folded
+
+
+# Static cost estimates relative to reading a field
+_FUNCTION_CALL_COST = 5
+_NUMBER_PARSE_COST = 5
+_REGEX_SEARCH_COST = 10
+
+
+def _static_cost(element: ProgramElement) -> int:
+    """A rough estimate of the cost of evaluating an element on a record."""
+    if isinstance(element, Literal):
+        return 0
+    if isinstance(element, Identifier):
+        return 1
+    if isinstance(element, BinaryOperator):
+        return 1 + _static_cost(element.left) + _static_cost(element.right)
+    if isinstance(element, SubString):
+        return 1 + _static_cost(element.string)
+    if isinstance(element, Match):
+        search_cost = 1 if element._literal is not None else _REGEX_SEARCH_COST
+        return search_cost + _static_cost(element.string)
+    if isinstance(element, AsNumber):
+        return _NUMBER_PARSE_COST + _static_cost(element.inner)
+    if isinstance(element, (AsString, CaseFold, UnaryNot)):
+        return 1 + _static_cost(element.inner)
+    if isinstance(element, (Conjunction, Disjunction)):
+        return sum(_static_cost(part) for part in element.parts)
+    return _FUNCTION_CALL_COST
+
+
+def _order_by_cost(parts: List[ProgramElement[bool]]) -> List[ProgramElement[bool]]:
+    """Order each run of consecutive pure parts by increasing static cost.
+
+    Pure parts can be evaluated in any order. Cheap parts go first so that they
+    can short-circuit the expensive ones. Parts of equal cost keep their order.
+    """
+    ordered: List[ProgramElement[bool]] = []
+    run: List[ProgramElement[bool]] = []
+    for part in parts:
+        if part.is_pure():
+            run.append(part)
+            continue
+        run.sort(key=_static_cost)
+        ordered.extend(run)
+        run = []
+        ordered.append(part)
+    run.sort(key=_static_cost)
+    ordered.extend(run)
+    return ordered
+
+
+def _parts_ast(
+    parts: List[ProgramElement[bool]], short_circuit: bool, generator: CodeGenerator
+) -> List[ast.expr]:
+    """Generate the parts of a short-circuiting boolean operator."""
+    if isinstance(generator, _ProfilingGenerator):
+        return generator.profile_parts(parts, short_circuit)
+    return [part.to_ast(generator) for part in parts]
+
+
+class _PartProfile:
+    """Evaluation statistics of a part of a boolean operator."""
+
+    def __init__(self, part: ProgramElement[bool]):
+        self.part = part
+        self._evaluate = part.compile()
+        self.num_calls = 0
+        self.num_true = 0
+        self.total_time = 0
+
+    def __call__(self, record: Record, context: RuntimeContext) -> bool:
+        start = time.perf_counter_ns()
+        value = self._evaluate(record, context)
+        self.total_time += time.perf_counter_ns() - start
+        self.num_calls += 1
+        if value:
+            self.num_true += 1
+        return value
+
+    def rank(self, short_circuit: bool) -> float:
+        """Expected evaluation time per short-circuit. Lower ranks go first."""
+        num_short_circuits = (
+            self.num_true if short_circuit else (self.num_calls - self.num_true)
+        )
+        if not num_short_circuits:
+            return float("inf")
+        return self.total_time / num_short_circuits
+
+
+class _ProfilingGenerator(CodeGenerator):
+    """Generates code that profiles the pure parts of boolean operators."""
+
+    def __init__(self, match_cache_size: int = 0):
+        super().__init__(match_cache_size=match_cache_size)
+        self._profiles: List[
+            Tuple[List[ProgramElement[bool]], List[Optional[_PartProfile]], bool]
+        ] = []
+
+    def profile_parts(
+        self, parts: List[ProgramElement[bool]], short_circuit: bool
+    ) -> List[ast.expr]:
+        profiles = [_PartProfile(part) if part.is_pure() else None for part in parts]
+        if sum(profile is not None for profile in profiles) < 2:
+            # Nothing to reorder
+            return [part.to_ast(self) for part in parts]
+        self._profiles.append((parts, profiles, short_circuit))
+        return [
+            part.to_ast(self) if profile is None else self.call(profile)
+            for part, profile in zip(parts, profiles)
+        ]
+
+    def reorder(self) -> None:
+        """Reorder each run of consecutive pure parts by increasing rank."""
+        for parts, profiles, short_circuit in self._profiles:
+            reordered: List[ProgramElement[bool]] = []
+            run: List[_PartProfile] = []
+            for part, profile in zip(parts, profiles):
+                if profile is not None:
+                    run.append(profile)
+                    continue
+                run.sort(key=lambda p: p.rank(short_circuit))
+                reordered.extend(p.part for p in run)
+                run = []
+                reordered.append(part)
+            run.sort(key=lambda p: p.rank(short_circuit))
+            reordered.extend(p.part for p in run)
+            parts[:] = reordered
+
+
 class _Executable(ProgramElement[None]):
     """Execute some behaviour on a record."""
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(dtype=DataType.NONE)
 
     def fields(self, input_fields: Iterable[str]) -> List[str]:
-        fields = OrderedSet(input_fields)
+        # Dictionary keys are an insertion-ordered set of field names
+        fields = dict.fromkeys(input_fields)
         self._update_fields(fields)
         return list(fields)
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
+    def _update_fields(self, fields: Dict[str, None]) -> None:
+        raise NotImplementedError
+
+    def _modifies_record(self) -> bool:
+        """Whether executing this may modify the record."""
         raise NotImplementedError
 
+    def to_statements(self, generator: CodeGenerator) -> List[ast.stmt]:
+        """Generate Python statements that execute this on the record."""
+        # The record may have been modified
+        return [ast.Expr(value=self.to_ast(generator)), generator.reload_fields()]
+
 
 class Statements(_Executable):
     """A sequence of executable statements."""
 
+    __slots__ = ("statements",)
+
     def __init__(self, statements: Sequence[_Executable]):
         super().__init__()
         self.statements = statements
@@ -268,10 +710,23 @@ class Statements(_Executable):
         for statement in self.statements:
             statement(record, context)
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
+    def fold(self) -> Statements:
+        return Statements([statement.fold() for statement in self.statements])
+
+    def to_statements(self, generator: CodeGenerator) -> List[ast.stmt]:
+        return [
+            line
+            for statement in self.statements
+            for line in statement.to_statements(generator)
+        ]
+
+    def _update_fields(self, fields: Dict[str, None]) -> None:
         for statement in self.statements:
             statement._update_fields(fields)
 
+    def _modifies_record(self) -> bool:
+        return any(statement._modifies_record() for statement in self.statements)
+
     def __str__(self):
         return "\n".join(str(statement) for statement in self.statements)
 
@@ -282,16 +737,28 @@ class Statements(_Executable):
 class Assignment(_Executable):
     """Assign a value to a field."""
 
+    __slots__ = ("name", "value")
+
     def __init__(self, name: str, value: ProgramElement):
         super().__init__()
-        self.name = name
+        self.name = sys.intern(name)
         self.value = string_encode(value)
 
     def _call(self, record: Record, context: RuntimeContext) -> None:
         record[self.name] = self.value(record, context)
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
-        fields.add(self.name)
+    def fold(self) -> Assignment:
+        self.value = self.value.fold()
+        return self
+
+    def to_statements(self, generator: CodeGenerator) -> List[ast.stmt]:
+        return generator.assign_field(self.name, self.value.to_ast(generator))
+
+    def _update_fields(self, fields: Dict[str, None]) -> None:
+        fields[self.name] = None
+
+    def _modifies_record(self) -> bool:
+        return True
 
     def __str__(self):
         return f"{{{self.name}}} = {self.value}"
@@ -300,6 +767,8 @@ class Assignment(_Executable):
 class BareExpression(_Executable):
     """An expression used as a statement."""
 
+    __slots__ = ("inner",)
+
     def __init__(self, inner: ProgramElement):
         super().__init__()
         self.inner = inner
@@ -308,9 +777,19 @@ class BareExpression(_Executable):
         self.inner(record, context)
         return None
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
+    def fold(self) -> BareExpression:
+        self.inner = self.inner.fold()
+        return self
+
+    def to_statements(self, generator: CodeGenerator) -> List[ast.stmt]:
+        return [ast.Expr(value=self.inner.to_ast(generator))]
+
+    def _update_fields(self, fields: Dict[str, None]) -> None:
         pass
 
+    def _modifies_record(self) -> bool:
+        return False
+
     def __str__(self):
         return str(self.inner)
 
@@ -318,6 +797,8 @@ class BareExpression(_Executable):
 class Rule(_Executable):
     """Conditionally execute some statements"""
 
+    __slots__ = ("ifthens", "else_")
+
     def __init__(
         self,
         ifthens: Iterable[Tuple[ProgramElement, _Executable]],
@@ -339,12 +820,101 @@ class Rule(_Executable):
         if self.else_ is not None:
             self.else_(record, context)
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
+    def fold(self) -> _Executable:
+        ifthens = []
+        else_ = self.else_
+        for condition, statement in self.ifthens:
+            condition = condition.fold()
+            statement = statement.fold()
+            if isinstance(condition, Literal):
+                if condition.value:
+                    # Always taken so any later branches are unreachable
+                    else_ = statement
+                    break
+                continue
+            ifthens.append((condition, statement))
+        else:
+            if else_ is not None:
+                else_ = else_.fold()
+
+        if not ifthens:
+            return else_ if else_ is not None else Statements([])
+        return Rule(ifthens, else_=else_)
+
+    def to_statements(self, generator: CodeGenerator) -> List[ast.stmt]:
+        blocks = [
+            _block(statement.to_statements(generator)) for _, statement in self.ifthens
+        ]
+        else_block = (
+            self.else_.to_statements(generator) if self.else_ is not None else []
+        )
+
+        dispatch = self._dispatch_table()
+        if dispatch is not None:
+            name, case_insensitive, table = dispatch
+            # Look up the index of the selected branch then bisect on the index.
+            value = generator.field(name)
+            if case_insensitive:
+                value = generator.derived(
+                    value,
+                    "casefold",
+                    lambda value: generator.method_call(value, "casefold"),
+                )
+            index = generator.variable()
+            lookup = ast.Assign(
+                targets=[ast.Name(id=index, ctx=ast.Store())],
+                value=generator.method_call(
+                    generator.constant(table),
+                    "get",
+                    value,
+                    ast.Constant(value=len(blocks)),
+                ),
+            )
+            return [lookup] + _bisect(index, blocks + [_block(else_block)], 0)
+
+        statements = else_block
+        for condition, block in reversed(list(zip(self.ifthens, blocks))):
+            statements = [
+                ast.If(
+                    test=condition[0].to_ast(generator), body=block, orelse=statements
+                )
+            ]
+        return statements
+
+    def _dispatch_table(self) -> Optional[Tuple[str, bool, Dict[str, int]]]:
+        """Index the branches of a rule that compares one field to string literals.
+
+        Returns:
+            None unless there are multiple branches and every condition has the form
+            `field == "value"` for the same field and case sensitivity.
+            Otherwise, a tuple (field, case_insensitive, table) where `table` maps
+            each value to the index of the first branch it selects.
+        """
+        if len(self.ifthens) < 2:
+            return None
+        field_equalities = [_field_equality(condition) for condition, _ in self.ifthens]
+        first = field_equalities[0]
+        if first is None:
+            return None
+        name, case_insensitive, _ = first
+        table: Dict[str, int] = {}
+        for i, field_equality in enumerate(field_equalities):
+            if field_equality is None or field_equality[:2] != first[:2]:
+                return None
+            table.setdefault(field_equality[2], i)
+        return name, case_insensitive, table
+
+    def _update_fields(self, fields: Dict[str, None]) -> None:
         for _, statement in self.ifthens:
             statement._update_fields(fields)
         if self.else_ is not None:
             self.else_._update_fields(fields)
 
+    def _modifies_record(self) -> bool:
+        return any(statement._modifies_record() for _, statement in self.ifthens) or (
+            self.else_ is not None and self.else_._modifies_record()
+        )
+
     def __str__(self):
         ifthen, *elifthens = self.ifthens
         condition, statement = ifthen
@@ -357,44 +927,214 @@ class Rule(_Executable):
         return "\n".join(lines)
 
 
+def _block(statements: List[ast.stmt]) -> List[ast.stmt]:
+    """A non-empty block of statements."""
+    return statements or [ast.Pass()]
+
+
+def _bisect(index: str, blocks: List[List[ast.stmt]], start: int) -> List[ast.stmt]:
+    """Select the block at position `index - start` by bisection."""
+    if len(blocks) == 1:
+        return blocks[0]
+    middle = len(blocks) // 2
+    return [
+        ast.If(
+            test=ast.Compare(
+                left=ast.Name(id=index, ctx=ast.Load()),
+                ops=[ast.Lt()],
+                comparators=[ast.Constant(value=start + middle)],
+            ),
+            body=_bisect(index, blocks[:middle], start),
+            orelse=_bisect(index, blocks[middle:], start + middle),
+        )
+    ]
+
+
+def _strip_casefold(element: ProgramElement) -> ProgramElement:
+    return element.inner if isinstance(element, CaseFold) else element
+
+
+def _field_equality(condition: ProgramElement) -> Optional[Tuple[str, bool, str]]:
+    """Match a condition of the form `field == "value"`.
+
+    Returns:
+        None if the condition does not have this form.
+        Otherwise, a tuple (field, case_insensitive, value).
+        If case insensitive then `value` is casefolded.
+    """
+    if not (
+        isinstance(condition, ValueComparisonOperator) and condition.op is operator.eq
+    ):
+        return None
+    left, right = condition.left, condition.right
+    if isinstance(_strip_casefold(left), Literal):
+        left, right = right, left
+
+    case_insensitive = isinstance(left, CaseFold)
+    if case_insensitive:
+        left = left.inner
+    # A casefolded literal may already have been folded to a literal
+    if isinstance(right, CaseFold):
+        if not case_insensitive:
+            return None
+        right = right.inner
+    if isinstance(left, AsString):
+        left = left.inner
+    if not (
+        isinstance(left, Identifier)
+        and isinstance(right, Literal)
+        and right.dtype == DataType.STRING
+    ):
+        return None
+    value = right.value.casefold() if case_insensitive else right.value
+    return left.name, case_insensitive, value
+
+
 class Fields(_Executable):
     """Specify an explicit set of fields, dropping all others."""
 
+    __slots__ = ("_fields",)
+
     def __init__(self, fields: Iterable[str]):
         super().__init__()
-        self._fields = OrderedSet(fields)
+        self._fields = dict.fromkeys(fields)
 
     def _call(self, record: Record, context: RuntimeContext) -> None:
-        new_record = {}
-        for field in self._fields:
-            try:
-                new_record[field] = record[field]
-            except KeyError:
-                pass
+        new_record = {field: record[field] for field in self._fields if field in record}
         record.clear()
         record.update(new_record)
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
+    def _update_fields(self, fields: Dict[str, None]) -> None:
         fields.clear()
         fields.update(self._fields)
 
+    def _modifies_record(self) -> bool:
+        return True
+
 
 class Program(_Executable):
-    def __init__(self, statements: _Executable):
+    """An edict program.
+
+    Args:
+        statements: The program statements.
+        reorder_conditions: Profile the conditions in the first records then
+            reorder the pure parts of conjunctions and disjunctions so that parts
+            that are cheap and likely to short-circuit are evaluated first.
+        num_profiled_records: Number of records to profile before reordering.
+        match_cache_size: Cache up to this many results of each regex match.
+            Speeds up matching fields that have few distinct values.
+    """
+
+    __slots__ = (
+        "statements",
+        "_folded",
+        "_match_cache_size",
+        "_generator",
+        "_run",
+        "_copy_records",
+    )
+
+    def __init__(
+        self,
+        statements: _Executable,
+        reorder_conditions: bool = False,
+        num_profiled_records: int = 1000,
+        match_cache_size: int = 0,
+    ):
         super().__init__()
+        self._match_cache_size = match_cache_size
         self.statements = statements
-
-    def _call(self, record: Record, context: RuntimeContext) -> None:
-        self.statements(record, context)
+        # Executed in place of the statements.
+        # Output fields are taken from the unfolded statements so that fields
+        # assigned in unreachable branches are still included.
+        self._folded = statements.fold()
+        self._run = self._compile()
+        # Records only need to be copied before transforming if they are modified
+        self._copy_records = self._folded._modifies_record()
+        if reorder_conditions:
+            self._profile_conditions(num_profiled_records)
+
+    def _compile(self) -> Evaluator[None]:
+        # Kept to locate errors raised by the function
+        self._generator = CodeGenerator(match_cache_size=self._match_cache_size)
+        return self._generator.function(self._folded.to_statements(self._generator))
+
+    def _profile_conditions(self, num_records: int) -> None:
+        """Run a profiling program then reorder conditions and recompile."""
+        generator = _ProfilingGenerator(match_cache_size=self._match_cache_size)
+        run_profiled = generator.function(self._folded.to_statements(generator))
+        num_profiled = 0
+
+        def profile(record: Record, context: RuntimeContext) -> None:
+            nonlocal num_profiled
+            run_profiled(record, context)
+            num_profiled += 1
+            if num_profiled == num_records:
+                generator.reorder()
+                self._run = self._compile()
+
+        self._generator = generator
+        self._run = profile
+
+    def __call__(self, record: Record, context: RuntimeContext) -> None:
+        """Evaluate on the given record."""
+        # Replaces the per-element error handling of ProgramElement.__call__,
+        # which would otherwise add a frame to every record.
+        try:
+            self._run(record, context)
+        except ERuntimeError:
+            raise
+        except Exception as e:
+            element = self._generator.element_at(e.__traceback__)
+            if element is None:
+                element = self
+            raise ERuntimeError(f"Error in {element!s}:\n{e!s}", record=record) from e
+
+    _call = __call__
 
     def transform(self, record: Record, context: RuntimeContext) -> Record:
-        """Return a transformed copy of a record."""
-        new_record = record.copy()
+        """Return a transformed copy of a record.
+
+        The record itself is returned if the program does not modify records.
+        """
+        new_record = record.copy() if self._copy_records else record
         self(new_record, context)
         return new_record
 
-    def _update_fields(self, fields: OrderedSet[str]) -> None:
+    def transform_many(
+        self, records: Iterable[Record], context: RuntimeContext, in_place: bool = False
+    ) -> Iterator[Record]:
+        """Lazily transform copies of a sequence of records.
+
+        The records themselves are produced if the program does not modify records.
+
+        Args:
+            records: The records to transform.
+            context: The runtime context.
+            in_place: Transform and produce the records themselves instead of copies.
+        """
+        call = self.__call__
+        if in_place or not self._copy_records:
+            for record in records:
+                call(record, context)
+                yield record
+            return
+
+        copy = dict.copy
+        for record in records:
+            new_record = copy(record)
+            call(new_record, context)
+            yield new_record
+
+    def to_statements(self, generator: CodeGenerator) -> List[ast.stmt]:
+        # Imported programs are inlined into the importing program
+        return self._folded.to_statements(generator)
+
+    def _update_fields(self, fields: Dict[str, None]) -> None:
         self.statements._update_fields(fields)
 
+    def _modifies_record(self) -> bool:
+        return self._copy_records
+
     def __str__(self):
         return f"{self.statements}\n"
@@ -1,13 +1,35 @@
 """Base definitions for Edict program objects."""
 
+import ast
+import sys
 from dataclasses import dataclass
 from decimal import Decimal
 from enum import Enum
-from typing import Generic, Optional, TypeVar
+from types import CodeType, TracebackType
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 from .types import Record
 
-__all__ = ["DataType", "ERuntimeError", "Error", "ProgramElement", "T", "string_encode"]
+__all__ = [
+    "CodeGenerator",
+    "DataType",
+    "ERuntimeError",
+    "Error",
+    "Evaluator",
+    "ProgramElement",
+    "T",
+    "string_encode",
+]
 
 
 class DataType(Enum):
@@ -75,9 +97,20 @@ class RuntimeContext:
     output_protocol: str
 
 
+# Constant elements do not depend on the context.
+_CONSTANT_CONTEXT = RuntimeContext(input_protocol="", output_protocol="")
+# Types of values that can be stored in a Literal.
+_LITERAL_TYPES = (DataType.STRING, DataType.NUMBER, DataType.BOOLEAN)
+
+# A compiled program element: evaluates the element on a record.
+Evaluator = Callable[[Record, RuntimeContext], T]
+
+
 class ProgramElement(Generic[T]):
     """Interface of a program element."""
 
+    __slots__ = ("dtype",)
+
     def __init__(self, dtype: DataType):
         self.dtype = dtype
 
@@ -94,16 +127,375 @@ class ProgramElement(Generic[T]):
         """Evaluate on the given record."""
         raise NotImplementedError
 
+    def is_constant(self) -> bool:
+        """Whether this evaluates to the same value on every record.
+
+        Constant elements have no side effects and do not depend on the context.
+        """
+        return False
+
+    def is_pure(self) -> bool:
+        """Whether evaluating this has no side effects and cannot raise an error.
+
+        Pure elements may be evaluated in any order or not at all.
+        """
+        return False
+
+    def fold(self) -> "ProgramElement[T]":
+        """Evaluate constant subexpressions once, replacing them with literals.
+
+        Returns:
+            An equivalent program element. May be this element, modified in place.
+        """
+        return self
+
+    def _fold_constant(self) -> "ProgramElement[T]":
+        """Replace this element with a literal if it is constant."""
+        # Imported here because .program imports this module
+        from .program import Literal
+
+        if self.dtype not in _LITERAL_TYPES or not self.is_constant():
+            return self
+        try:
+            value = self._call({}, _CONSTANT_CONTEXT)
+        except Exception:
+            # Raise the error at runtime if and when it is evaluated
+            return self
+        return Literal(value, self.dtype)
+
+    def compile(self) -> Evaluator[T]:
+        """Compile to a function that evaluates this element on a record.
+
+        The function is generated from `to_ast` and skips the per-element error
+        handling of `__call__`.
+        Errors raised by the compiled function are not wrapped in `ERuntimeError`.
+        """
+        generator = CodeGenerator()
+        return generator.function([ast.Return(value=self.to_ast(generator))])
+
+    def to_ast(self, generator: "CodeGenerator") -> ast.expr:
+        """Generate a Python expression that evaluates this element.
+
+        The expression may refer to the record and runtime context by the names
+        `CodeGenerator.RECORD` and `CodeGenerator.CONTEXT`.
+        """
+        return generator.locate(self._to_ast(generator), self)
+
+    def _to_ast(self, generator: "CodeGenerator") -> ast.expr:
+        """Generate a Python expression that evaluates this element.
+
+        Defaults to calling `_call`.
+        """
+        return generator.call(self._call)
+
+
+class CodeGenerator:
+    """Generates Python code for program elements.
+
+    Values that cannot be written as Python literals are bound to names in the
+    global namespace of the generated code.
+    Record fields are read into local variables at the start of the function.
+    Each program element is generated on its own line so that errors can be
+    attributed to the element from the traceback.
+
+    Args:
+        match_cache_size: Cache up to this many regex match results per pattern.
+    """
+
+    RECORD = "record"
+    CONTEXT = "context"
+
+    def __init__(self, match_cache_size: int = 0):
+        self.match_cache_size = match_cache_size
+        self.namespace: Dict[str, Any] = {}
+        self._num_variables = 0
+        # Local variable holding the current value of each field read or assigned
+        self._fields: Dict[str, str] = {}
+        # Fields that are read. Dictionary keys are an insertion-ordered set.
+        self._read_fields: Dict[str, None] = {}
+        # Field of each field variable
+        self._field_names: Dict[str, str] = {}
+        # Local variables caching values derived from each field, by key
+        self._derived: Dict[str, Dict[Hashable, str]] = {}
+        # Statements to fill in with a reset of the values derived from a field
+        self._derived_resets: List[Tuple[str, ast.Assign]] = []
+        # Statements to fill in with a reload of all fields
+        self._reloads: List[ast.Assign] = []
+        # The element generated on each line, starting from line 2
+        self._elements: List[ProgramElement] = []
+        self._code: Optional[CodeType] = None
+
+    def constant(self, value: Any) -> ast.expr:
+        """An expression for a constant value."""
+        if value is None or isinstance(value, (str, bool)):
+            return ast.Constant(value=value)
+        name = f"_c{len(self.namespace)}"
+        self.namespace[name] = value
+        return ast.Name(id=name, ctx=ast.Load())
+
+    def variable(self) -> str:
+        """The name of a new local variable."""
+        name = f"_v{self._num_variables}"
+        self._num_variables += 1
+        return name
+
+    def record(self) -> ast.expr:
+        """An expression for the record."""
+        return ast.Name(id=self.RECORD, ctx=ast.Load())
+
+    def context(self) -> ast.expr:
+        """An expression for the runtime context."""
+        return ast.Name(id=self.CONTEXT, ctx=ast.Load())
+
+    def locate(self, node: ast.expr, element: ProgramElement) -> ast.expr:
+        """Place the code of an element on a new line.
+
+        Nodes already placed are left alone: the inner element is more specific.
+        """
+        if getattr(node, "lineno", None) is None:
+            self._elements.append(element)
+            node.lineno = node.end_lineno = len(self._elements) + 1
+            node.col_offset = node.end_col_offset = 0
+        return node
+
+    def element_at(
+        self, traceback: Optional[TracebackType]
+    ) -> Optional[ProgramElement]:
+        """The element that raised an exception with the given traceback.
+
+        Returns:
+            The element at the innermost call of the generated function in the
+            traceback. None if the function is not in the traceback.
+        """
+        lineno = None
+        while traceback is not None:
+            if traceback.tb_frame.f_code is self._code:
+                lineno = traceback.tb_lineno
+            traceback = traceback.tb_next
+        if lineno is None or not 2 <= lineno <= len(self._elements) + 1:
+            return None
+        return self._elements[lineno - 2]
+
+    def field(self, name: str) -> ast.expr:
+        """An expression for the value of a record field. Empty if missing."""
+        self._read_fields[name] = None
+        return ast.Name(id=self._field_variable(name), ctx=ast.Load())
+
+    def _field_variable(self, name: str) -> str:
+        try:
+            return self._fields[name]
+        except KeyError:
+            variable = self._fields[name] = self.variable()
+            self._field_names[variable] = name
+            return variable
+
+    def derived(
+        self, value: ast.expr, key: Hashable, derive: Callable[[ast.expr], ast.expr]
+    ) -> ast.expr:
+        """An expression for a value derived from another.
+
+        Values derived from a record field are cached until the field changes, so
+        they are derived at most once per field value.
+
+        Args:
+            value: The expression to derive from.
+            key: Identifies the derivation among those of the same field.
+            derive: Generates the derivation from an expression for `value`.
+        """
+        if not isinstance(value, ast.Name) or value.id not in self._field_names:
+            return derive(value)
+        derived = self._derived.setdefault(self._field_names[value.id], {})
+        try:
+            variable = derived[key]
+        except KeyError:
+            variable = derived[key] = self.variable()
+        # The field values are strings so None marks a value not yet derived
+        return ast.IfExp(
+            test=self.is_not_none(ast.Name(id=variable, ctx=ast.Load())),
+            body=ast.Name(id=variable, ctx=ast.Load()),
+            orelse=ast.NamedExpr(
+                target=ast.Name(id=variable, ctx=ast.Store()), value=derive(value)
+            ),
+        )
+
+    def assign_field(self, name: str, value: ast.expr) -> List[ast.stmt]:
+        """Statements that assign a value to a record field."""
+        # Also assigned to the field variable in case the field is read later
+        targets: List[ast.expr] = [
+            self.subscript(self.record(), ast.Constant(value=name), ast.Store()),
+            ast.Name(id=self._field_variable(name), ctx=ast.Store()),
+        ]
+        reset = ast.Assign(targets=[], value=ast.Constant(value=None))
+        self._derived_resets.append((name, reset))
+        return [ast.Assign(targets=targets, value=value), reset]
+
+    def reload_fields(self) -> ast.stmt:
+        """A statement that reads all fields again after the record is modified.
+
+        Required after any modification of the record other than `assign_field`.
+        """
+        statement = ast.Assign(targets=[], value=ast.Constant(value=None))
+        self._reloads.append(statement)
+        return statement
+
+    def _read_field(self, name: str) -> ast.expr:
+        return self.method_call(
+            self.record(), "get", ast.Constant(value=name), ast.Constant(value="")
+        )
+
+    def _reload(self) -> ast.Assign:
+        names = list(self._read_fields)
+        derived = self._derived_variables()
+        return ast.Assign(
+            targets=[
+                ast.Tuple(
+                    elts=[
+                        ast.Name(id=variable, ctx=ast.Store())
+                        for variable in [self._fields[name] for name in names] + derived
+                    ],
+                    ctx=ast.Store(),
+                )
+            ],
+            value=ast.Tuple(
+                elts=[self._read_field(name) for name in names]
+                + [ast.Constant(value=None) for _ in derived],
+                ctx=ast.Load(),
+            ),
+        )
+
+    def _derived_variables(self, name: Optional[str] = None) -> List[str]:
+        """Variables of values derived from a field or from any field if None."""
+        if name is not None:
+            return list(self._derived.get(name, {}).values())
+        return [
+            variable
+            for derived in self._derived.values()
+            for variable in derived.values()
+        ]
+
+    def call(self, evaluator: Evaluator) -> ast.expr:
+        """An expression that calls an evaluator on the record and context."""
+        return ast.Call(
+            func=self.constant(evaluator),
+            args=[self.record(), self.context()],
+            keywords=[],
+        )
+
+    def method_call(self, value: ast.expr, method: str, *args: ast.expr) -> ast.expr:
+        """An expression that calls a method on a value."""
+        return ast.Call(
+            func=ast.Attribute(value=value, attr=method, ctx=ast.Load()),
+            args=list(args),
+            keywords=[],
+        )
+
+    def subscript(
+        self, value: ast.expr, index: ast.expr, ctx: ast.expr_context = ast.Load()
+    ) -> ast.expr:
+        """An expression that indexes a value."""
+        if sys.version_info < (3, 9):
+            # Indices were wrapped in ast.Index before Python 3.9
+            index = ast.Index(value=index)  # type: ignore
+        return ast.Subscript(value=value, slice=index, ctx=ctx)
+
+    def is_not_none(self, value: ast.expr) -> ast.expr:
+        """An expression for whether a value is not None."""
+        return ast.Compare(
+            left=value, ops=[ast.IsNot()], comparators=[ast.Constant(value=None)]
+        )
+
+    def function(self, body: List[ast.stmt]) -> Evaluator:
+        """Compile a function of the record and context with the given body."""
+        for reload in self._reloads:
+            read = self._reload()
+            reload.targets = read.targets
+            reload.value = read.value
+        unused_resets = []
+        for name, reset in self._derived_resets:
+            reset.targets = [
+                ast.Name(id=variable, ctx=ast.Store())
+                for variable in self._derived_variables(name)
+            ]
+            if not reset.targets:
+                unused_resets.append(reset)
+        read_fields: List[ast.stmt] = [
+            ast.Assign(
+                targets=[ast.Name(id=self._fields[name], ctx=ast.Store())],
+                value=self._read_field(name),
+            )
+            for name in self._read_fields
+        ]
+        derived = self._derived_variables()
+        if derived:
+            read_fields.append(
+                ast.Assign(
+                    targets=[
+                        ast.Name(id=variable, ctx=ast.Store()) for variable in derived
+                    ],
+                    value=ast.Constant(value=None),
+                )
+            )
+        body = read_fields + body
+
+        name = "_edict"
+        function = ast.FunctionDef(
+            name=name,
+            args=ast.arguments(
+                posonlyargs=[],
+                args=[ast.arg(arg=self.RECORD), ast.arg(arg=self.CONTEXT)],
+                kwonlyargs=[],
+                kw_defaults=[],
+                defaults=[],
+            ),
+            body=body or [ast.Pass()],
+            decorator_list=[],
+        )
+        function = _RemoveStatements(unused_resets).visit(function)
+        module = ast.fix_missing_locations(ast.Module(body=[function], type_ignores=[]))
+        exec(compile(module, "<edict>", "exec"), self.namespace)
+        evaluator = self.namespace.pop(name)
+        self._code = evaluator.__code__
+        return evaluator
+
+
+class _RemoveStatements(ast.NodeTransformer):
+    """Removes the given statements from a syntax tree."""
+
+    def __init__(self, statements: List[ast.stmt]):
+        self._ids = {id(statement) for statement in statements}
+
+    def visit_Assign(self, node: ast.Assign) -> Optional[ast.Assign]:
+        return None if id(node) in self._ids else node
+
 
 class _StringEncodeNumber(ProgramElement[str]):
     """Encode a number as a string."""
 
+    __slots__ = ("inner",)
+
     def __init__(self, inner: ProgramElement[Decimal]):
+        super().__init__(dtype=DataType.STRING)
         self.inner = inner
 
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return str(self.inner(record, context))
 
+    def is_constant(self) -> bool:
+        return self.inner.is_constant()
+
+    def fold(self) -> ProgramElement[str]:
+        self.inner = self.inner.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        # Not memoized: equal decimals can have different string representations
+        # e.g. Decimal("1.0") == Decimal("1.00")
+        return ast.Call(
+            func=generator.constant(str),
+            args=[self.inner.to_ast(generator)],
+            keywords=[],
+        )
+
     def __str__(self):
         return f"{self.__class__.__name__}({self.inner})"
 
@@ -111,12 +503,29 @@ class _StringEncodeNumber(ProgramElement[str]):
 class _StringEncodeBoolean(ProgramElement[str]):
     """Encode a Boolean as a string."""
 
+    __slots__ = ("inner",)
+
     def __init__(self, inner: ProgramElement[bool]):
+        super().__init__(dtype=DataType.STRING)
         self.inner = inner
 
     def _call(self, record: Record, context: RuntimeContext) -> str:
         return "true" if self.inner(record, context) else "false"
 
+    def is_constant(self) -> bool:
+        return self.inner.is_constant()
+
+    def fold(self) -> ProgramElement[str]:
+        self.inner = self.inner.fold()
+        return self._fold_constant()
+
+    def _to_ast(self, generator: CodeGenerator) -> ast.expr:
+        return ast.IfExp(
+            test=self.inner.to_ast(generator),
+            body=ast.Constant(value="true"),
+            orelse=ast.Constant(value="false"),
+        )
+
     def __str__(self):
         return f"{self.__class__.__name__}({self.inner})"
 
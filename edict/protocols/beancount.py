@@ -1,28 +1,66 @@
 "Beancount IO Protocols"
 from __future__ import annotations
 
-from typing import Dict, Iterable, List, Optional, TextIO
+import re
+from typing import Dict, Iterable, List, NamedTuple, TextIO
 
 from ..types import Record, RecordStream
 
 __all__ = ["write_beancount_journal"]
 
 
-def _get_beancount_posting_numbers(fields: Iterable[str]) -> List[int]:
-    prefix = "account"
-    prefix_len = len(prefix)
-    posting_numbers = set()
+# Posting fields: a name followed by a nonnegative integer posting number
+_POSTING_FIELD_PATTERN = re.compile(r"(\D+)(\d+)")
+
+
+class _PostingFields(NamedTuple):
+    """Names of the record fields of a posting."""
+
+    account: str
+    status: str
+    comment: str
+    virtual: str
+    balanced_virtual: str
+    currency: str
+    pricecurrency: str
+    amount: str
+    lotunitprice: str
+    unitprice: str
+
+
+# Posting field names without the posting number, in _PostingFields order
+_POSTING_FIELD_NAMES = (
+    "account",
+    "status",
+    "comment",
+    "virtual",
+    "balanced virtual",
+    "currency",
+    "pricecurrency",
+    "amount",
+    "lotunitprice",
+    "unitprice",
+)
+
+
+def _get_posting_fields(fields: Iterable[str]) -> List[_PostingFields]:
+    """Get the fields of each posting in a record stream ordered by posting number.
+
+    A posting number N is only included if there is an `accountN` field.
+    """
+    postings: Dict[int, Dict[str, str]] = {}
     for field in fields:
-        if not field.startswith(prefix):
-            continue
-        try:
-            n = int(field[prefix_len:])
-        except ValueError:
-            pass
-        else:
-            if n >= 0:
-                posting_numbers.add(n)
-    return list(sorted(posting_numbers))
+        match = _POSTING_FIELD_PATTERN.fullmatch(field)
+        if match is not None:
+            name, n = match.groups()
+            postings.setdefault(int(n), {})[name] = field
+    return [
+        _PostingFields(
+            *(posting.get(name, f"{name}{n}") for name in _POSTING_FIELD_NAMES)
+        )
+        for n, posting in sorted(postings.items())
+        if "account" in posting
+    ]
 
 
 def write_beancount_journal(f: TextIO, data: RecordStream, args: Dict) -> None:
@@ -41,8 +79,8 @@ def write_beancount_journal(f: TextIO, data: RecordStream, args: Dict) -> None:
     For example, date must be formatted as YYYY-MM-DD (or / or . instead of -)
     """
 
-    for record in data.records:
-        _write_record(f, record)
+    posting_fields = _get_posting_fields(data.fields)
+    f.writelines(_format_record(record, posting_fields) for record in data.records)
 
 
 # Translation table for quoted string sanitization
@@ -54,94 +92,89 @@ _TRANS_SANITIZE = str.maketrans(
 )
 
 
-def _record_value(
-    record: Record,
-    key: str,
-    fmt: Optional[str] = None,
-    default: str = "",
-    sanitize: bool = True,
-) -> str:
-    value = record.get(key, default)
-    if value is None:
-        value = default
-    if sanitize:
-        value = value.translate(_TRANS_SANITIZE)
-    if value and fmt is not None:
-        value = fmt.format(value)
-    return value
-
-
-def _write_record(f: TextIO, record: Record) -> None:
-    """Write a record as a Beancount directive"""
+def _record_value(record: Record, key: str, prefix: str = "", suffix: str = "") -> str:
+    """Get a sanitized record value between a prefix and suffix if it is not empty."""
+    value = record.get(key)
+    if not value:
+        return ""
+    return f"{prefix}{value.translate(_TRANS_SANITIZE)}{suffix}"
+
+
+def _format_record(record: Record, posting_fields: List[_PostingFields]) -> str:
+    """Format a record as a Beancount directive"""
     directive = record.get("directive", "")
     if directive in ("", "*", "txn", "transaction"):
-        _write_transaction(f, record)
+        return _format_transaction(record, posting_fields)
     elif directive == "open":
         date = record["date"]
         account = record["account"]
-        currency = _record_value(record, "currency", " {}")
-        booking_method = _record_value(record, "booking method", ' "{}"')
-        comment = _record_value(record, "comment", "; {}")
-        f.write(f"{date} open {account}{currency}{booking_method}{comment}\n")
+        currency = _record_value(record, "currency", " ")
+        booking_method = _record_value(record, "booking method", ' "', '"')
+        comment = _record_value(record, "comment", "; ")
+        return f"{date} open {account}{currency}{booking_method}{comment}\n"
     elif directive == "close":
         date = record["date"]
         account = record["account"]
-        f.write(f"{date} close {account}\n")
+        return f"{date} close {account}\n"
     elif directive == "price":
         date = record["date"]
         target = record["target"]
         price = record["price"]
         price_currency = record["currency"]
-        f.write(f"{date} price {target} {price} {price_currency}\n")
+        return f"{date} price {target} {price} {price_currency}\n"
     else:
         raise ValueError(f"Invalid directive type {directive!r}")
 
 
-def _write_transaction(f: TextIO, record: Record) -> None:
-    """Write a record as an beancount transaction."""
+def _format_transaction(record: Record, posting_fields: List[_PostingFields]) -> str:
+    """Format a record as an beancount transaction."""
     date = record["date"]  # required
     payee = ""
-    if description := _record_value(record, "description", ' "{}"'):
-        payee = _record_value(record, "payee", " {}")
-    comment = _record_value(record, "comment", " ; {}")
-    f.write(f"{date} txn{payee}{description}{comment}\n")
+    if description := _record_value(record, "description", ' "', '"'):
+        payee = _record_value(record, "payee", " ")
+    comment = _record_value(record, "comment", " ; ")
+    lines = [f"{date} txn{payee}{description}{comment}\n"]
 
     default_currency = _record_value(record, "currency")
 
-    for n in _get_beancount_posting_numbers(record):
-        _write_posting(f, record, n, default_currency)
-    f.write("\n")
+    for posting in posting_fields:
+        if posting.account in record:
+            lines.append(_format_posting(record, posting, default_currency))
+    lines.append("\n")
+    return "".join(lines)
 
 
-def _write_posting(f: TextIO, record: Record, n: int, default_currency: str) -> None:
-    """Write the n-th posting of an beancount transaction."""
-    # _get_beancount_posting_numbers should only return values that exist
-    account = record[f"account{n}"]
+def _format_posting(
+    record: Record, posting: _PostingFields, default_currency: str
+) -> str:
+    """Format a posting of an beancount transaction as a line."""
+    account = record[posting.account]
     if not account:
-        return
+        return ""
+    get = record.get
 
-    status = _record_value(record, f"status{n}", " {}")
-    comment = _record_value(record, f"comment{n}", " ; {}")
+    status = _record_value(record, posting.status, " ")
+    comment = _record_value(record, posting.comment, " ; ")
 
-    if record.get(f"virtual{n}"):
+    if get(posting.virtual):
         account = f"({account})"
-    elif record.get(f"balanced virtual{n}"):
+    elif get(posting.balanced_virtual):
         account = f"[{account}]"
 
-    currency = record.get(f"currency{n}")
+    currency = get(posting.currency)
     if not currency:
         currency = default_currency
 
-    price_currency = record.get(f"pricecurrency{n}")
+    price_currency = get(posting.pricecurrency)
     if not price_currency:
         price_currency = default_currency
 
-    amount = record.get(f"amount{n}", "")
+    amount = get(posting.amount, "")
     if amount:
         if currency:
             amount = f"{amount} {currency}"
 
-        if lotunitprice := record.get(f"lotunitprice{n}"):
+        if lotunitprice := get(posting.lotunitprice):
             if lotunitprice == "IMPLICIT":
                 amount = f"{amount} {{}}"
             else:
@@ -149,7 +182,7 @@ def _write_posting(f: TextIO, record: Record, n: int, default_currency: str) ->
                     lotunitprice = f"{lotunitprice} {price_currency}"
                 amount = f"{amount} {{{lotunitprice}}}"
 
-        if unitprice := record.get(f"unitprice{n}"):
+        if unitprice := get(posting.unitprice):
             if price_currency:
                 unitprice = f"{unitprice} {price_currency}"
             amount = f"{amount} @ {unitprice}"
@@ -159,4 +192,4 @@ def _write_posting(f: TextIO, record: Record, n: int, default_currency: str) ->
     if suffix := f"{amount}{comment}":
         suffix = f"  {suffix}"
 
-    f.write(f"    {status}{account}{suffix}\n")
+    return f"    {status}{account}{suffix}\n"
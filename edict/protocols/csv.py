@@ -3,39 +3,64 @@
 from __future__ import annotations
 
 import csv
-from typing import Dict, Iterable, TextIO
+import sys
+from typing import Dict, Iterable, Iterator, List, Sequence, TextIO
 
 from ..types import Record, RecordStream
 
 __all__ = ["read_csv"]
 
 
-def _csv_records(reader: csv.DictReader, file: TextIO) -> Iterable[Record]:
-    for record in reader:
-        if None in record:
-            values = record[None]  # type: ignore
+def _csv_records(
+    reader: Iterator[List[str]], fields: List[str], file: TextIO
+) -> Iterable[Record]:
+    num_fields = len(fields)
+    # Line 1 is the header
+    for line_num, row in enumerate(reader, start=2):
+        if len(row) > num_fields:
+            values = row[num_fields:]
             raise ValueError(
                 "\n".join(
                     [
                         "Error reading CSV input",
-                        f"{file.name}:{reader.line_num}",
+                        f"{file.name}:{line_num}",
                         f"Encountered value(s) {values} not in a named CSV column.",
                     ]
                 )
             )
-        yield {k: v for (k, v) in record.items() if v is not None}
+        # Like csv.DictReader, skip empty rows and omit missing trailing values
+        if row:
+            yield dict(zip(fields, row))
 
 
 def read_csv(f: TextIO, args: Dict) -> RecordStream:
-    reader = csv.DictReader(f)
-    fields = reader.fieldnames
-    if fields is None:
+    reader = csv.reader(f)
+    try:
+        header = next(reader)
+    except StopIteration:
         raise ValueError("First line must contain field names.")
+    # Records are keyed by these field names. Interned keys let lookups by the
+    # interned names of program identifiers succeed on an identity check.
+    fields = [sys.intern(field) for field in header]
 
-    return RecordStream(fields=list(fields), records=_csv_records(reader, f))
+    return RecordStream(fields=fields, records=_csv_records(reader, fields, f))
+
+
+def _csv_rows(records: Iterable[Record], fields: Sequence[str]) -> Iterable[List[str]]:
+    field_set = frozenset(fields)
+    for record in records:
+        # Like csv.DictWriter, refuse to silently drop fields missing from the header
+        if not field_set.issuperset(record):
+            wrong_fields = record.keys() - field_set
+            raise ValueError(
+                "dict contains fields not in fieldnames: "
+                + ", ".join([repr(x) for x in wrong_fields])
+            )
+        yield [record.get(field, "") for field in fields]
 
 
 def write_csv(f: TextIO, data: RecordStream, args: Dict) -> None:
-    writer = csv.DictWriter(f, data.fields, lineterminator="\n")
-    writer.writeheader()
-    writer.writerows(data.records)
+    fields = data.fields
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(fields)
+    writer.writerows(_csv_rows(data.records, fields))
@@ -1,29 +1,69 @@
 "HLedger Output Protocol"
 from __future__ import annotations
 
+import functools
 import re
-from typing import Dict, Iterable, List, Optional, TextIO
+from typing import Dict, Iterable, List, NamedTuple, Optional, TextIO
 
 from ..types import Record, RecordStream
 
 __all__ = ["write_hledger_journal"]
 
 
-def _get_hledger_posting_numbers(fields: Iterable[str]) -> List[int]:
-    prefix = "account"
-    prefix_len = len(prefix)
-    posting_numbers = set()
+# Posting fields: a name followed by a nonnegative integer posting number
+_POSTING_FIELD_PATTERN = re.compile(r"(\D+)(\d+)")
+
+
+class _PostingFields(NamedTuple):
+    """Names of the record fields of a posting."""
+
+    account: str
+    status: str
+    comment: str
+    virtual: str
+    balanced_virtual: str
+    currency: str
+    pricecurrency: str
+    amount: str
+    unitprice: str
+    totalprice: str
+    balance: str
+
+
+# Posting field names without the posting number, in _PostingFields order
+_POSTING_FIELD_NAMES = (
+    "account",
+    "status",
+    "comment",
+    "virtual",
+    "balanced virtual",
+    "currency",
+    "pricecurrency",
+    "amount",
+    "unitprice",
+    "totalprice",
+    "balance",
+)
+
+
+def _get_posting_fields(fields: Iterable[str]) -> List[_PostingFields]:
+    """Get the fields of each posting in a record stream ordered by posting number.
+
+    A posting number N is only included if there is an `accountN` field.
+    """
+    postings: Dict[int, Dict[str, str]] = {}
     for field in fields:
-        if not field.startswith(prefix):
-            continue
-        try:
-            n = int(field[prefix_len:])
-        except ValueError:
-            pass
-        else:
-            if n >= 0:
-                posting_numbers.add(n)
-    return list(sorted(posting_numbers))
+        match = _POSTING_FIELD_PATTERN.fullmatch(field)
+        if match is not None:
+            name, n = match.groups()
+            postings.setdefault(int(n), {})[name] = field
+    return [
+        _PostingFields(
+            *(posting.get(name, f"{name}{n}") for name in _POSTING_FIELD_NAMES)
+        )
+        for n, posting in sorted(postings.items())
+        if "account" in posting
+    ]
 
 
 # If currency matches then must quote it
@@ -31,6 +71,14 @@ def _get_hledger_posting_numbers(fields: Iterable[str]) -> List[int]:
 _QUOTE_CURRENCY_PATTERN = re.compile(r'[-+\d\s.@*;"}{=]')
 
 
+@functools.lru_cache(maxsize=1024)
+def _quote_currency(currency: str) -> str:
+    """Quote a currency or commodity symbol if hledger requires it."""
+    if _QUOTE_CURRENCY_PATTERN.search(currency):
+        return f'"{currency}"'
+    return currency
+
+
 def write_hledger_journal(f: TextIO, data: RecordStream, args: Dict) -> None:
     """Write an hledger journal file.
 
@@ -47,32 +95,33 @@ def write_hledger_journal(f: TextIO, data: RecordStream, args: Dict) -> None:
     For example, date must be formatted as YYYY-MM-DD (or / or . instead of -)
     """
 
-    for record in data.records:
-        _write_record(f, record)
+    posting_fields = _get_posting_fields(data.fields)
+    f.writelines(_format_record(record, posting_fields) for record in data.records)
 
 
-def _write_record(f: TextIO, record: Record) -> None:
-    """Write a record as an hledger transaction."""
+def _format_record(record: Record, posting_fields: List[_PostingFields]) -> str:
+    """Format a record as an hledger transaction."""
+    get = record.get
     date = record["date"]  # required
-    if date2 := record.get("date2", ""):
+    if date2 := get("date2", ""):
         date2 = f"={date2}"
-    if status := record.get("status", ""):
+    if status := get("status", ""):
         status = f" {status}"
-    if code := record.get("code", ""):
+    if code := get("code", ""):
         code = f" ({code})"
-    if description := record.get("description", ""):
+    if description := get("description", ""):
         description = f" {description}"
-    if comment := record.get("comment", ""):
+    if comment := get("comment", ""):
         comment = f"  ; {comment}"
-    f.write(f"{date}{date2}{status}{code}{description}{comment}\n")
+    lines = [f"{date}{date2}{status}{code}{description}{comment}\n"]
 
-    default_currency = record.get("currency", "")
-    if _QUOTE_CURRENCY_PATTERN.search(default_currency):
-        default_currency = '"' + default_currency + '"'
+    default_currency = _quote_currency(get("currency", ""))
 
-    for n in _get_hledger_posting_numbers(record):
-        _write_posting(f, record, n, default_currency)
-    f.write("\n")
+    for posting in posting_fields:
+        if posting.account in record:
+            lines.append(_format_posting(record, posting, default_currency))
+    lines.append("\n")
+    return "".join(lines)
 
 
 def _with_currency(amount: str, currency: Optional[str]) -> str:
@@ -86,46 +135,48 @@ def _with_currency(amount: str, currency: Optional[str]) -> str:
     return f"{currency}{currency_sep}{amount}"
 
 
-def _write_posting(f: TextIO, record: Record, n: int, default_currency: str) -> None:
-    """Write the n-th posting of an hledger transaction."""
-    # _get_hledger_posting_numbers should only return values that exist
-    account = record[f"account{n}"]
+def _format_posting(
+    record: Record, posting: _PostingFields, default_currency: str
+) -> str:
+    """Format a posting of an hledger transaction as a line."""
+    account = record[posting.account]
     if not account:
-        return
+        return ""
+    get = record.get
 
-    if status := record.get(f"status{n}", ""):
+    if status := get(posting.status, ""):
         status = f" {status}"
 
-    if comment := record.get(f"comment{n}", ""):
+    if comment := get(posting.comment, ""):
         comment = f"  ; {comment}"
 
-    if record.get(f"virtual{n}"):
+    if get(posting.virtual):
         account = f"({account})"
-    elif record.get(f"balanced virtual{n}"):
+    elif get(posting.balanced_virtual):
         account = f"[{account}]"
 
-    currency = record.get(f"currency{n}")
+    currency = get(posting.currency)
     if not currency:
         currency = default_currency
-    elif _QUOTE_CURRENCY_PATTERN.search(currency):
-        currency = f'"{currency}"'
+    else:
+        currency = _quote_currency(currency)
 
-    price_currency = record.get(f"pricecurrency{n}")
+    price_currency = get(posting.pricecurrency)
     if not price_currency:
         price_currency = default_currency
-    elif _QUOTE_CURRENCY_PATTERN.search(currency):
-        price_currency = f'"{price_currency}"'
+    else:
+        price_currency = _quote_currency(price_currency)
 
-    amount = record.get(f"amount{n}", "")
+    amount = get(posting.amount, "")
     if amount:
         amount = _with_currency(amount, currency)
 
-        if unitprice := record.get(f"unitprice{n}"):
+        if unitprice := get(posting.unitprice):
             amount = f"{amount} @ {_with_currency(unitprice, price_currency)}"
-        elif totalprice := record.get(f"totalprice{n}"):
+        elif totalprice := get(posting.totalprice):
             amount = f"{amount} @@ {_with_currency(totalprice, price_currency)}"
 
-    balance = record.get(f"balance{n}", "")
+    balance = get(posting.balance, "")
     if balance and currency:
         balance = f"{currency}{balance}"
     if balance:
@@ -134,4 +185,4 @@ def _write_posting(f: TextIO, record: Record, n: int, default_currency: str) ->
     if suffix := f"{amount}{balance}{comment}":
         suffix = f"  {suffix}"
 
-    f.write(f"    {status}{account}{suffix}\n")
+    return f"    {status}{account}{suffix}\n"
@@ -2,13 +2,47 @@
 
 from __future__ import annotations
 
-from typing import Dict, TextIO
+import operator
+import string
+from typing import Callable, Dict, TextIO
 
-from ..types import RecordStream
+from ..types import Record, RecordStream
 
 
 def write_pattern(f: TextIO, data: RecordStream, args: Dict) -> None:
-    pattern = args["pattern"]
-    for record in data.records:
-        f.write(pattern.format(**record))
-        f.write("\n")
+    format_record = _compile_pattern(args["pattern"] + "\n")
+    f.writelines(map(format_record, data.records))
+
+
+def _is_simple_field(name: str) -> bool:
+    """Whether a format field name is a plain keyword argument name."""
+    return bool(name) and not name.isdigit() and "." not in name and "[" not in name
+
+
+def _compile_pattern(pattern: str) -> Callable[[Record], str]:
+    """Compile a format string into a function that formats a record.
+
+    The result matches `pattern.format(**record)`.
+    Patterns that only substitute record values are parsed once into a
+    printf-style template; any others are formatted with `str.format`.
+    """
+    template = []
+    names = []
+    for literal, name, format_spec, conversion in string.Formatter().parse(pattern):
+        template.append(literal.replace("%", "%%"))
+        if name is None:
+            continue
+        if format_spec or conversion or not _is_simple_field(name):
+            return lambda record: pattern.format(**record)
+        template.append("%s")
+        names.append(name)
+
+    template_str = "".join(template)
+    if not names:
+        text = template_str % ()
+        return lambda record: text
+    if len(names) == 1:
+        (name,) = names
+        return lambda record: template_str % (record[name],)
+    get_values = operator.itemgetter(*names)
+    return lambda record: template_str % get_values(record)
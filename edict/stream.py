@@ -1,6 +1,8 @@
 """Stream editors."""
 
-from edict.types import RecordStream
+from typing import Iterable, List
+
+from edict.types import Record, RecordStream
 
 __all__ = [
     "Reverse",
@@ -23,7 +25,13 @@ class Reverse(StreamEditor):
         super().__init__()
 
     def __call__(self, data):
-        return RecordStream(fields=data.fields, records=reversed(list(data.records)))
+        return RecordStream(fields=data.fields, records=_pop_all(list(data.records)))
+
+
+def _pop_all(records: List[Record]) -> Iterable[Record]:
+    """Yield records from last to first, releasing each one as it is yielded."""
+    while records:
+        yield records.pop()
 
 
 STREAM_EDITORS = {e.name: e for e in [Reverse]}
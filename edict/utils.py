@@ -2,17 +2,14 @@
 
 from __future__ import annotations
 
-from typing import Any, Generic, Iterable, Iterator, Optional, TypeVar
+from typing import Any, Dict, Generic, Iterable, Iterator, Optional, TypeVar
 
 T = TypeVar("T")
 
 
 class OrderedSet(Generic[T]):
     def __init__(self, elems: Optional[Iterable[T]] = None):
-        if elems is None:
-            self._data = {}
-        else:
-            self._data = {x: None for x in elems}
+        self._data: Dict[T, None] = {} if elems is None else dict.fromkeys(elems)
 
     def __eq__(self, other: Any):
         if isinstance(other, OrderedSet):
@@ -33,8 +30,7 @@ class OrderedSet(Generic[T]):
 
     def update(self, *others: Iterable[T]) -> None:
         for other in others:
-            for key in other:
-                self._data[key] = None
+            self._data.update(dict.fromkeys(other))
 
     def clear(self) -> None:
         self._data.clear()
@@ -9,6 +9,8 @@ import edict
 
 files_dir = pathlib.Path(__file__).parent / "files"
 edict_files = files_dir.glob("*.edt")
+# Programs that must be rejected when loaded
+invalid_edict_files = sorted((files_dir / "invalid").glob("*.edt"))
 
 
 class Application(NamedTuple):
@@ -69,3 +71,11 @@ def test_application(application):
         fout_target = fout.read()
 
     assert out.getvalue() == fout_target
+
+
+@pytest.mark.parametrize(
+    "edict_file", invalid_edict_files, ids=[f.stem for f in invalid_edict_files]
+)
+def test_invalid_edict(edict_file):
+    with pytest.raises(ValueError):
+        edict.load(edict_file)